@@ -1,33 +1,73 @@
 # app.py
-from flask import Flask, jsonify, request, render_template, send_file
-import threading, time, random, csv, os
+from flask import Flask, jsonify, request, render_template, send_file, make_response
+import threading, time, csv, os, atexit, hashlib
+import numpy as np
 from datetime import datetime
+from dataclasses import dataclass
+
+# O Numba é opcional: ele compila as contas da simulação para código de máquina.
+# Se não estiver instalado, usamos um decorador "vazio" e tudo roda em Python normal.
+try:
+    from numba import njit
+except ImportError:
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+# O orjson também é opcional: ele transforma dicionários em JSON bem mais rápido
+# que o módulo padrão do Python. Sem ele, usamos o jsonify do próprio Flask.
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 # --- 1. CONFIGURAÇÃO DO SERVIDOR WEB (FLASK) ---
 # Aqui iniciamos o Flask, que é o "cérebro" do site.
 app = Flask(__name__)
 
-# Estas configurações forçam o site a recarregar se fizermos mudanças no HTML,
-# útil para desenvolvimento sem precisar reiniciar o servidor toda hora.
-app.config['TEMPLATES_AUTO_RELOAD'] = True 
-app.jinja_env.auto_reload = True
+# Recarregar o HTML a cada mudança só é útil durante o desenvolvimento.
+# Deixando TEMPLATES_AUTO_RELOAD = None, o Flask liga o recarregamento automaticamente
+# quando rodamos com debug=True, e desliga em produção (onde ele só gastaria tempo).
+app.config['TEMPLATES_AUTO_RELOAD'] = None
 
 # --- 2. ESTADO GLOBAL DO SISTEMA (A "MEMÓRIA" DA ESTUFA) ---
-# Este dicionário 'state' guarda tudo o que está acontecendo AGORA.
+# Este objeto 'state' guarda tudo o que está acontecendo AGORA.
 # É compartilhado entre a simulação (backend) e o site (frontend).
-state = {
-    "temperatura": 25.0,     # Leitura atual do sensor de temperatura (°C)
-    "umidade": 60.0,         # Leitura atual do sensor de umidade do ar (%)
-    "soil_moisture": 50.0,   # Leitura atual do sensor de umidade do solo (%)
-    "aquecedor": False,      # Estado do atuador: True (Ligado) ou False (Desligado)
-    "ventilador": False,     # Estado do atuador: True (Ligado) ou False (Desligado)
-    "pump": False,           # Estado da bomba de água
-    "pump_run_seconds": 0,   # Contador de segurança: quanto tempo a bomba está ligada direto
-    "modo_auto": True,       # Se True, o computador decide. Se False, o usuário clica nos botões.
-    "alarm": "",             # Mensagem de erro para exibir no topo do site (ex: "Temp Alta!")
-    "pid_output": 0,         # Valor calculado pelo algoritmo PID (apenas para visualização)
-    "setpoint": 25.0         # A meta: qual temperatura queremos manter?
-}
+# Usamos uma classe com __slots__ (em vez de um dicionário) porque ler
+# 'state.temperatura' é mais rápido que procurar a chave "temperatura" num dicionário.
+@dataclass(slots=True)
+class State:
+    temperatura: float = 25.0     # Leitura atual do sensor de temperatura (°C)
+    umidade: float = 60.0         # Leitura atual do sensor de umidade do ar (%)
+    soil_moisture: float = 50.0   # Leitura atual do sensor de umidade do solo (%)
+    aquecedor: bool = False       # Estado do atuador: True (Ligado) ou False (Desligado)
+    ventilador: bool = False      # Estado do atuador: True (Ligado) ou False (Desligado)
+    pump: bool = False            # Estado da bomba de água
+    pump_run_seconds: int = 0     # Contador de segurança: quanto tempo a bomba está ligada direto
+    modo_auto: bool = True        # Se True, o computador decide. Se False, o usuário clica nos botões.
+    alarm: str = ""               # Mensagem de erro para exibir no topo do site (ex: "Temp Alta!")
+    pid_output: float = 0.0       # Valor calculado pelo algoritmo PID (apenas para visualização)
+    setpoint: float = 25.0        # A meta: qual temperatura queremos manter?
+
+    def to_dict(self):
+        """
+        Converte o estado num dicionário (para enviar como JSON ao site).
+        Na simulação guardamos os números com precisão total; só arredondamos
+        para 2 casas aqui, na hora de mostrar.
+        """
+        dados = {}
+        for campo in self.__slots__:
+            valor = getattr(self, campo)
+            dados[campo] = round(valor, 2) if isinstance(valor, float) else valor
+        return dados
+
+state = State()
+
+# A simulação, a rota /dados e a rota /comando mexem no 'state' ao mesmo tempo
+# (cada uma numa thread). Este "cadeado" garante que só uma delas mexe por vez,
+# para o site nunca receber um estado pela metade (ex: temperatura nova com aquecedor antigo).
+_state_lock = threading.Lock()
 
 # --- 3. PARÂMETROS DE TEMPO E CONTROLE ---
 DT = 1.0                  # "Delta Time": Quanto tempo (segundos) passa a cada ciclo do loop.
@@ -50,12 +90,22 @@ pid_last_error = 0.0      # O erro da medição anterior (para calcular a veloci
 # Como o aquecedor é digital (só liga ou desliga), usamos PWM para simular potência.
 # Ex: Para 30% de força, ligamos por 3 segundos e desligamos por 7 segundos.
 PWM_PERIOD = 10.0         # Tamanho total do ciclo em segundos
-pwm_counter = 0.0         # Contador interno para saber em qual segundo do ciclo estamos
+PWM_STEPS = int(PWM_PERIOD / DT)   # Quantos ciclos da simulação cabem num período PWM (10)
+PWM_PCT_PER_STEP = 100.0 / PWM_STEPS # Quanto (%) de potência cada passo do período representa (10%)
+pwm_counter = 0           # Contador interno (inteiro) para saber em qual passo do ciclo estamos
 
 # --- 6. LIMITES E SEGURANÇA ---
 SOIL_LOW = 40.0           # Se o solo cair abaixo disso, liga a bomba.
 SOIL_HIGH = 60.0          # Se o solo passar disso, desliga a bomba.
 MAX_PUMP_SECONDS = 600    # Segurança: desliga a bomba se ficar ligada por 10 minutos (evita queimar).
+# Mensagens de alarme possíveis. A posição na lista é o "código" do alarme (0 = sem alarme).
+ALARMES = ("", "🚨 Temp Baixa!", "🚨 Temp Alta!", "🚨 Solo Seco!")
+# Tabela pronta de "qual alarme mostrar" para cada combinação de problemas.
+# O índice é uma chave de 3 bits: bit 0 = temp < 18, bit 1 = temp > 35, bit 2 = solo < 20.
+# Quando há mais de um problema, vale a mesma prioridade de sempre: Baixa > Alta > Seco.
+_ALARM_TBL = (ALARMES[0], ALARMES[1], ALARMES[2], ALARMES[1],
+              ALARMES[3], ALARMES[1], ALARMES[2], ALARMES[1])
+_last_alarm_k = None      # Chave do último alarme aplicado (None = aplicar de novo no próximo ciclo)
 
 # --- 7. FÍSICA DA SIMULAÇÃO (REGRAS DO MUNDO REAL) ---
 # Estas variáveis definem como a "natureza" se comporta dentro do código.
@@ -64,6 +114,33 @@ EVAP_BASE = 0.02          # Evaporação mínima que sempre acontece, mesmo no f
 AIR_DRYING_FACTOR = 0.005 # Quanto o ar seca a cada grau de temperatura (ar quente retém mais água).
 SOIL_EVAP_FACTOR = 0.005  # Quanto o calor faz a água do solo evaporar.
 SOIL_TO_AIR_TRANSFER = 0.4 # CICLO DA ÁGUA: 40% da água que sai do solo vira vapor e aumenta a umidade do ar.
+NOISE_TEMP = 0.05         # Tamanho máximo do ruído do sensor de temperatura (°C por segundo).
+NOISE_HUM = 0.1           # Tamanho máximo do ruído do sensor de umidade do ar (% por segundo).
+
+# Em vez de sortear um número aleatório de cada vez, sorteamos um bloco grande
+# de uma só vez com o NumPy (valores entre -1 e 1) e vamos consumindo em ordem.
+# Quando o bloco acaba, sorteamos outro.
+NOISE_SIZE = 1 << 16      # 65536 números por bloco
+_rng = np.random.default_rng()
+_NOISE = _rng.uniform(-1.0, 1.0, NOISE_SIZE)
+_noise_idx = 0            # Posição do próximo número a ser usado no bloco
+
+# Se a simulação atrasar, recuperamos no máximo 1 hora de ciclos de uma vez.
+MAX_CATCHUP_STEPS = 3600
+
+# Constantes pré-calculadas: várias contas do loop são "constante * DT", que dá
+# sempre o mesmo resultado. Fazemos essas multiplicações uma vez só, aqui.
+_K_HEAT = 0.5 * DT                         # Quanto o aquecedor sobe a temperatura por ciclo
+_K_VENT = 0.4 * DT                         # Quanto o ventilador baixa a temperatura por ciclo
+_K_COOL = 0.05 * DT                        # Fração da diferença para o ambiente (20°C) perdida por ciclo
+_K_EVAP_BASE = EVAP_BASE * DT              # Evaporação mínima por ciclo
+_K_EVAP_TEMP = SOIL_EVAP_FACTOR * DT       # Evaporação extra por grau, por ciclo
+_K_PUMP = PUMP_RATE * DT                   # Água que a bomba joga no solo por ciclo
+_K_AIR_DRY = AIR_DRYING_FACTOR * DT        # Quanto o ar seca por grau, por ciclo
+_K_HUM_GAIN = 0.05 * DT                    # Ganho natural de umidade por ciclo
+_K_NOISE_TEMP = NOISE_TEMP * DT            # Escala do ruído de temperatura por ciclo
+_K_NOISE_HUM = NOISE_HUM * DT              # Escala do ruído de umidade por ciclo
+_K_D = Kd / DT                             # Kd já dividido pelo tempo (termo derivativo)
 
 # --- 8. SISTEMA DE ARQUIVO (HISTÓRICO) ---
 HISTORY_FILE = "historico.csv"
@@ -73,36 +150,142 @@ if not os.path.exists(HISTORY_FILE):
         writer = csv.writer(f)
         writer.writerow(["timestamp","temperatura","umidade","soil_moisture","aquecedor","ventilador","pump","alarm"])
 
+# Em vez de abrir e fechar o arquivo a cada segundo, deixamos ele aberto o tempo todo.
+# As linhas ficam guardadas numa lista na memória e são gravadas em lote.
+HISTORY_BATCH_SIZE = 60   # Quantas linhas juntamos antes de gravar no arquivo (1 minuto)
+_hist_fh = open(HISTORY_FILE, "a", newline="", buffering=8192)
+_hist_writer = csv.writer(_hist_fh)
+_hist_buf = []                  # Linhas que ainda não foram gravadas
+_hist_lock = threading.Lock()   # Evita que a simulação e o site gravem ao mesmo tempo
+
+def flush_history_buffer():
+    """Grava no disco todas as linhas que estão esperando na memória."""
+    with _hist_lock:
+        if _hist_buf:
+            _hist_writer.writerows(_hist_buf)
+            _hist_buf.clear()
+        _hist_fh.flush()
+
+# Além do arquivo, guardamos as últimas 24 horas na memória (um "buffer circular":
+# quando enche, a linha mais nova sobrescreve a mais antiga). É dele que sai o gráfico
+# "Últimos 5 minutos" da página (rota /recentes), sem precisar reler o CSV.
+# Para gastar pouca memória, cada coluna é um array do NumPy (e não uma lista de objetos):
+#   - os 3 sensores ficam em float32 (4 bytes cada);
+#   - os 3 atuadores e o código do alarme ficam juntos em 1 único byte (bits);
+#   - a data e hora não é guardada inteira: como as linhas chegam a cada ~1 segundo,
+#     guardamos só a DIFERENÇA (em milissegundos) para a linha anterior, que cabe em 4 bytes.
+#     A diferença é medida no relógio monotônico, que não pula quando o relógio do sistema
+#     é acertado (ex: Raspberry Pi sem bateria que sincroniza a hora pela internet depois de ligar).
+#     Só a linha mais nova guarda a data e hora "de verdade", como âncora.
+RING_N = 24 * 3600        # 1 linha por segundo durante 24 horas
+_ring_dt = np.zeros(RING_N, dtype=np.uint32)            # Milissegundos desde a linha anterior
+_ring_floats = np.zeros((RING_N, 3), dtype=np.float32)  # temperatura, umidade, soil_moisture
+_ring_bits = np.zeros(RING_N, dtype=np.uint8)           # bit 0 aquecedor, bit 1 ventilador, bit 2 pump, bits 3-4 alarme
+_ring_pos = 0             # Posição onde a próxima linha será escrita
+_ring_len = 0             # Quantas linhas válidas existem (no máximo RING_N)
+_ring_last_ms = None      # Data e hora completa da linha mais nova (milissegundos desde 1970)
+_ring_last_mono_ms = None # Relógio monotônico (milissegundos) da linha mais nova
+_RING_DT_MAX = int(np.iinfo(np.uint32).max)  # Maior diferença que cabe em 4 bytes (~49,7 dias)
+
+def historico_recente(n):
+    """
+    Devolve as últimas 'n' linhas do buffer circular, da mais antiga para a mais nova,
+    no formato de colunas: {"timestamp": [...], "temperatura": [...], ...}.
+    """
+    with _hist_lock:
+        n = max(0, min(n, _ring_len))
+        idx = np.arange(_ring_pos - n, _ring_pos) % RING_N
+        dt = _ring_dt[idx].astype(np.int64)
+        last_ms = _ring_last_ms
+        floats = _ring_floats[idx]
+        bits = _ring_bits[idx]
+    # Reconstrói as datas andando para trás a partir da linha mais nova:
+    # data[k] = data_mais_nova - (soma das diferenças das linhas depois de k)
+    depois = np.cumsum(dt[::-1])[::-1] - dt
+    ts = last_ms - depois if n else dt
+    # Converte para float64 antes de arredondar, para não aparecer "lixo" do float32 (ex: 24.739999771)
+    floats = np.round(floats.astype(np.float64), 2)
+    return {
+        "timestamp": ts.tolist(),
+        "temperatura": floats[:, 0].tolist(),
+        "umidade": floats[:, 1].tolist(),
+        "soil_moisture": floats[:, 2].tolist(),
+        "aquecedor": (bits & 1).astype(bool).tolist(),
+        "ventilador": ((bits >> 1) & 1).astype(bool).tolist(),
+        "pump": ((bits >> 2) & 1).astype(bool).tolist(),
+        "alarm": [ALARMES[c] for c in (bits >> 3).tolist()],
+    }
+
+# Ao desligar o programa, gravamos o que sobrou e fechamos o arquivo.
+# (O atexit roda na ordem inversa: primeiro o flush, depois o close.)
+atexit.register(_hist_fh.close)
+atexit.register(flush_history_buffer)
+
+def _ring_append(agora, agora_mono_ms, sensores, atuadores, alarm):
+    """Guarda uma linha no buffer circular da memória (chamar com o _hist_lock fechado)."""
+    global _ring_pos, _ring_len, _ring_last_ms, _ring_last_mono_ms
+    aquecedor, ventilador, pump = atuadores
+    if _ring_last_mono_ms is None:
+        _ring_dt[_ring_pos] = 0
+    else:
+        # min(...) garante que a diferença sempre cabe no uint32
+        _ring_dt[_ring_pos] = min(agora_mono_ms - _ring_last_mono_ms, _RING_DT_MAX)
+    _ring_floats[_ring_pos] = sensores     # Convertidos para float32 aqui
+    # Junta os 3 atuadores e o código do alarme num único número de 8 bits
+    _ring_bits[_ring_pos] = aquecedor | (ventilador << 1) | (pump << 2) | (ALARMES.index(alarm) << 3)
+    _ring_last_mono_ms = agora_mono_ms
+    _ring_last_ms = int(agora.timestamp() * 1000)
+    _ring_pos = (_ring_pos + 1) % RING_N
+    _ring_len = min(_ring_len + 1, RING_N)
+
 def append_history():
     """
-    Função auxiliar que pega o estado atual e salva uma linha no arquivo CSV.
+    Função auxiliar que pega o estado atual e guarda uma linha para o arquivo CSV
+    (e para o buffer circular da memória).
     Isso permite gerar gráficos históricos depois.
     """
     try:
-        with open(HISTORY_FILE, "a", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                datetime.now().isoformat(), # Data e hora atual
-                state["temperatura"],
-                state["umidade"],
-                state["soil_moisture"],
-                int(state["aquecedor"]),    # Converte True/False para 1/0
-                int(state["ventilador"]),
-                int(state["pump"]),
-                state["alarm"]
-            ])
+        agora = datetime.now()
+        agora_mono_ms = int(time.monotonic() * 1000)
+        with _state_lock:
+            sensores = (state.temperatura, state.umidade, state.soil_moisture)
+            atuadores = (int(state.aquecedor), int(state.ventilador), int(state.pump)) # True/False -> 1/0
+            alarm = state.alarm
+        with _hist_lock:
+            # 1. Primeiro a linha do CSV, que é o registro que fica salvo no disco.
+            #    Os sensores já saem formatados com 2 casas decimais (o arquivo não precisa de mais).
+            _hist_buf.append((
+                agora.isoformat(),          # Data e hora atual
+                "%.2f" % sensores[0],
+                "%.2f" % sensores[1],
+                "%.2f" % sensores[2],
+                *atuadores,
+                alarm
+            ))
+            full = len(_hist_buf) >= HISTORY_BATCH_SIZE
+
+            # 2. Depois o buffer circular. Ele tem seu próprio tratamento de erro:
+            #    um problema nele nunca pode impedir a gravação do CSV.
+            try:
+                _ring_append(agora, agora_mono_ms, sensores, atuadores, alarm)
+            except Exception as e:
+                print(f"Erro ao gravar buffer circular: {e}")
+        # Só gravamos no arquivo quando o lote estiver cheio.
+        if full:
+            flush_history_buffer()
     except Exception as e:
         print(f"Erro ao gravar CSV: {e}")
 
 # --- 9. FUNÇÃO MATEMÁTICA DO PID ---
-def calcular_pid(temp_atual):
+@njit(cache=True)
+def calcular_pid(temp_atual, integral, last_error):
     """
     Recebe a temperatura atual e decide 'quanto' esforço precisamos fazer.
     Retorno positivo: Precisa Aquecer.
     Retorno negativo: Precisa Resfriar.
+    Devolve também o novo acumulador (integral) e o erro atual, que serão
+    usados no próximo ciclo.
     """
-    global pid_integral, pid_last_error
-    
     # Passo 1: Calcular o ERRO (Onde quero estar - Onde estou)
     erro = SETPOINT_TEMP - temp_atual
     
@@ -112,188 +295,351 @@ def calcular_pid(temp_atual):
     
     # Passo 3: Termo Integral (I)
     # Acumula o erro ao longo do tempo. Se o erro persiste, o I cresce para forçar a correção.
-    pid_integral += erro * DT
+    integral += erro * DT
     # "Anti-windup": Limitamos o acumulador para ele não crescer infinitamente e travar o sistema.
-    pid_integral = max(min(pid_integral, 50), -50) 
-    I = Ki * pid_integral
+    integral = max(min(integral, 50.0), -50.0) 
+    I = Ki * integral
     
     # Passo 4: Termo Derivativo (D)
     # Calcula a velocidade da mudança (Erro atual - Erro anterior).
     # Serve para frear o sistema se ele estiver indo rápido demais em direção à meta.
-    derivative = (erro - pid_last_error) / DT
-    D = Kd * derivative
-    
-    # Atualiza o erro anterior para o próximo ciclo usar
-    pid_last_error = erro
+    # (_K_D é Kd / DT, calculado uma vez só)
+    D = _K_D * (erro - last_error)
     
-    # Soma tudo para ter a saída final
-    return P + I + D
+    # Soma tudo para ter a saída final (o erro atual vira o "erro anterior" do próximo ciclo)
+    return P + I + D, integral, erro
 
 # --- 10. LOOP PRINCIPAL DE SIMULAÇÃO ---
+@njit(cache=True)
+def _step(temp, hum, soil, aquecedor, ventilador, pump, pump_run_seconds, modo_auto,
+          pid_output, pid_integral, pid_last_error, pwm_counter, ruido_temp, ruido_hum):
+    """
+    Calcula UM ciclo da simulação usando apenas números (sem Flask, sem CSV).
+    Por ser só matemática, o Numba consegue compilar esta função para código de máquina.
+    Os ruídos aleatórios chegam prontos como parâmetros (ruido_temp, ruido_hum),
+    já na escala de um ciclo.
+    Devolve todos os valores atualizados, na mesma ordem da entrada.
+    """
+    # --- PARTE A: CÉREBRO (CONTROLE AUTOMÁTICO) ---
+    if modo_auto:
+        
+        # 1. Calcula o PID para saber a "força" necessária
+        pid_out, pid_integral, pid_last_error = calcular_pid(temp, pid_integral, pid_last_error)
+        pid_output = pid_out
+
+        # 2. Aplica PWM (Transforma força analógica em pulsos digitais ON/OFF)
+        # Duty Cycle é a porcentagem de tempo que o aquecedor fica ligado no ciclo.
+        duty_cycle = min(abs(pid_out), 100.0) # Limita em 100%
+        
+        # Verifica se no segundo atual do ciclo o aparelho deve estar ligado
+        is_active_cycle = (pwm_counter * PWM_PCT_PER_STEP) < duty_cycle
+
+        if pid_out > 0: 
+            # Se o PID for positivo, precisamos de CALOR
+            aquecedor = is_active_cycle
+            ventilador = False
+        else: 
+            # Se o PID for negativo, precisamos RESFRIAR (Ventilador)
+            aquecedor = False
+            ventilador = is_active_cycle
+        
+        # Avança o contador do ciclo PWM (0, 1, 2 ... 9, 0, 1 ...)
+        pwm_counter = (pwm_counter + 1) % PWM_STEPS
+
+        # 3. Controle de Água (Lógica Simples de Liga/Desliga com margem)
+        if soil < SOIL_LOW and not pump:
+            # Se está muito seco e a bomba está desligada, liga.
+            if pump_run_seconds < MAX_PUMP_SECONDS:
+                pump = True
+        elif soil >= SOIL_HIGH and pump:
+            # Se já está úmido o suficiente, desliga.
+            pump = False
+
+    # --- PARTE B: NATUREZA (SIMULAÇÃO FÍSICA) ---
+    
+    # 1. Física da Temperatura
+    if aquecedor:
+        temp += _K_HEAT  # Aquecedor sobe a temperatura
+    elif ventilador:
+        temp -= _K_VENT  # Ventilador baixa a temperatura
+        
+    # Perda térmica (Inércia): A temperatura tende a voltar lentamente para 20°C (ambiente externo)
+    temp -= (temp - 20.0) * _K_COOL
+    # Adiciona um pequeno ruído aleatório para parecer um sensor real
+    temp += ruido_temp
+    # Salva garantindo limites (0 a 60 graus)
+    temp = max(0.0, min(60.0, temp))
+
+    # 2. Física da Água (Solo -> Ar)
+    
+    # Taxa de evaporação: Quanto mais quente, mais água evapora do solo.
+    water_evaporated = _K_EVAP_BASE + temp * _K_EVAP_TEMP # Quantidade exata evaporada neste ciclo
+    
+    # Retira a água do solo
+    soil -= water_evaporated
+    
+    # Se a bomba estiver ligada, adiciona água ao solo
+    if pump:
+        soil += _K_PUMP
+        pump_run_seconds += 1 # Conta tempo de segurança
+    else:
+        pump_run_seconds = 0
+        
+    soil = max(0.0, min(100.0, soil))
+
+    # 3. Física da Umidade do Ar
+    
+    # O ar seca naturalmente quando esquenta (capacidade de reter água aumenta, umidade relativa cai)
+    hum -= temp * _K_AIR_DRY
+    
+    # A água que evaporou do solo vai para o ar! (Aumento da umidade)
+    hum += water_evaporated * SOIL_TO_AIR_TRANSFER
+    
+    # Ruído natural
+    hum += _K_HUM_GAIN
+    hum += ruido_hum
+    
+    hum = max(10.0, min(100.0, hum))
+
+    return (temp, hum, soil, aquecedor, ventilador, pump, pump_run_seconds,
+            pid_output, pid_integral, pid_last_error, pwm_counter)
+
+@njit(cache=True)
+def _step_n(n, temp, hum, soil, aquecedor, ventilador, pump, pump_run_seconds, modo_auto,
+            pid_output, pid_integral, pid_last_error, pwm_counter, ruido):
+    """
+    Roda 'n' ciclos seguidos de _step() numa única chamada.
+    'ruido' é um pedaço do bloco de ruído com 2 números por ciclo (temperatura, umidade).
+    Cada ciclo depende do anterior, então não dá para calcular todos "de uma vez";
+    mas, compilado pelo Numba, o laço inteiro roda sem passar pelo Python.
+    Útil para recuperar o atraso da simulação (n = segundos perdidos) ou para
+    testar valores de Kp/Ki/Kd rapidamente (n = 3600 simula uma hora).
+    """
+    for i in range(n):
+        # float() garante um número normal do Python quando o Numba não está instalado
+        ruido_temp = float(ruido[2 * i]) * _K_NOISE_TEMP
+        ruido_hum = float(ruido[2 * i + 1]) * _K_NOISE_HUM
+        (temp, hum, soil, aquecedor, ventilador, pump, pump_run_seconds,
+         pid_output, pid_integral, pid_last_error, pwm_counter) = _step(
+            temp, hum, soil, aquecedor, ventilador, pump, pump_run_seconds, modo_auto,
+            pid_output, pid_integral, pid_last_error, pwm_counter, ruido_temp, ruido_hum)
+    return (temp, hum, soil, aquecedor, ventilador, pump, pump_run_seconds,
+            pid_output, pid_integral, pid_last_error, pwm_counter)
+
 def simular():
     """
     Esta função roda em paralelo (thread) eternamente.
     Ela faz duas coisas:
     1. Atua como o 'Cérebro' (Controlador): Liga/Desliga coisas baseado nos sensores.
     2. Atua como a 'Natureza' (Física): Simula a temperatura subindo/descendo e a água secando.
+    A matemática fica toda em _step(); aqui só lemos o 'state', chamamos _step_n e
+    guardamos o resultado de volta.
     """
-    global pwm_counter
+    global pwm_counter, pid_integral, pid_last_error, _noise_idx, _last_alarm_k
     
+    # "Aquecimento": na primeira chamada o Numba compila _step_n (pode levar vários segundos).
+    # Fazemos isso aqui, com n = 0 e valores de mentira com os mesmos tipos dos de verdade,
+    # para a compilação não acontecer com o cadeado do 'state' fechado (travando o site).
+    _step_n(0, 25.0, 60.0, 50.0, False, False, False, 0, True, 0.0, 0.0, 0.0, 0, _NOISE[:0])
+
+    # Horário (relógio monotônico, que nunca volta para trás) em que o próximo ciclo deve começar.
+    # Usamos ele em vez de um simples sleep(DT) para que o tempo gasto nas contas
+    # não vá se acumulando e atrasando a simulação ao longo das horas.
+    next_t = time.monotonic()
+
     while True:
-        # --- PARTE A: CÉREBRO (CONTROLE AUTOMÁTICO) ---
-        if state["modo_auto"]:
-            
-            # 1. Calcula o PID para saber a "força" necessária
-            pid_out = calcular_pid(state["temperatura"])
-            state["pid_output"] = round(pid_out, 2)
+        # Quantos ciclos estão "vencidos"? Normalmente 1; se a thread ficou parada
+        # (computador travou, por exemplo), recuperamos os segundos perdidos de uma vez.
+        # max(1, ...) porque, se acordarmos um pouquinho antes de next_t, a conta dá 0.
+        n = max(1, 1 + int((time.monotonic() - next_t) // DT))
+        if n > MAX_CATCHUP_STEPS:
+            # Atraso grande demais: desistimos de recuperar e recomeçamos a contagem a partir de agora
+            n = 1
+            next_t = time.monotonic()
 
-            # 2. Aplica PWM (Transforma força analógica em pulsos digitais ON/OFF)
-            # Duty Cycle é a porcentagem de tempo que o aquecedor fica ligado no ciclo.
-            duty_cycle = min(abs(pid_out), 100.0) # Limita em 100%
-            
-            # Verifica se no segundo atual do ciclo o aparelho deve estar ligado
-            is_active_cycle = (pwm_counter * 10) < duty_cycle
-
-            if pid_out > 0: 
-                # Se o PID for positivo, precisamos de CALOR
-                state["aquecedor"] = is_active_cycle
-                state["ventilador"] = False
-            else: 
-                # Se o PID for negativo, precisamos RESFRIAR (Ventilador)
-                state["aquecedor"] = False
-                state["ventilador"] = is_active_cycle
-            
-            # Avança o contador do ciclo PWM (0, 1, 2 ... 9, 0, 1 ...)
-            pwm_counter = (pwm_counter + 1) % (PWM_PERIOD / DT)
-
-            # 3. Controle de Água (Lógica Simples de Liga/Desliga com margem)
-            if state["soil_moisture"] < SOIL_LOW and not state["pump"]:
-                # Se está muito seco e a bomba está desligada, liga.
-                if state["pump_run_seconds"] < MAX_PUMP_SECONDS:
-                    state["pump"] = True
-            elif state["soil_moisture"] >= SOIL_HIGH and state["pump"]:
-                # Se já está úmido o suficiente, desliga.
-                state["pump"] = False
-
-        # --- PARTE B: NATUREZA (SIMULAÇÃO FÍSICA) ---
-        
-        # 1. Física da Temperatura
-        temp = state["temperatura"]
-        if state["aquecedor"]:
-            temp += 0.5 * DT  # Aquecedor sobe a temperatura
-        elif state["ventilador"]:
-            temp -= 0.4 * DT  # Ventilador baixa a temperatura
-            
-        # Perda térmica (Inércia): A temperatura tende a voltar lentamente para 20°C (ambiente externo)
-        temp -= (temp - 20.0) * 0.05 * DT 
-        # Adiciona um pequeno ruído aleatório para parecer um sensor real
-        temp += random.uniform(-0.05, 0.05) * DT
-        # Salva garantindo limites (0 a 60 graus)
-        state["temperatura"] = round(max(0.0, min(60.0, temp)), 2)
-
-        # 2. Física da Água (Solo -> Ar)
-        soil = state["soil_moisture"]
-        
-        # Taxa de evaporação: Quanto mais quente, mais água evapora do solo.
-        evaporation_rate = EVAP_BASE + (state["temperatura"] * SOIL_EVAP_FACTOR)
-        water_evaporated = evaporation_rate * DT # Quantidade exata evaporada neste segundo
-        
-        # Retira a água do solo
-        soil -= water_evaporated
-        
-        # Se a bomba estiver ligada, adiciona água ao solo
-        if state["pump"]:
-            soil += PUMP_RATE * DT
-            state["pump_run_seconds"] += 1 # Conta tempo de segurança
-        else:
-            state["pump_run_seconds"] = 0
-            
-        state["soil_moisture"] = round(max(0.0, min(100.0, soil)), 2)
+        # Pega 2 números por ciclo do bloco de ruído (um para a temperatura, outro para a umidade)
+        if _noise_idx + 2 * n > NOISE_SIZE:
+            # Bloco acabou: sorteia outro, reaproveitando o mesmo espaço de memória
+            _NOISE[:] = _rng.uniform(-1.0, 1.0, NOISE_SIZE)
+            _noise_idx = 0
+        ruido = _NOISE[_noise_idx:_noise_idx + 2 * n]
+        _noise_idx += 2 * n
 
-        # 3. Física da Umidade do Ar
-        hum = state["umidade"]
-        
-        # O ar seca naturalmente quando esquenta (capacidade de reter água aumenta, umidade relativa cai)
-        hum -= (state["temperatura"] * AIR_DRYING_FACTOR) * DT
-        
-        # A água que evaporou do solo vai para o ar! (Aumento da umidade)
-        hum += water_evaporated * SOIL_TO_AIR_TRANSFER
-        
-        # Ruído natural
-        hum += 0.05 * DT 
-        hum += random.uniform(-0.1, 0.1) * DT
-        
-        state["umidade"] = round(max(10.0, min(100.0, hum)), 2)
+        # Seguramos o cadeado enquanto lemos, calculamos e gravamos o estado (leva microssegundos)
+        with _state_lock:
+            # 'st' é só outro nome (local) para o mesmo objeto 'state' global: o Python acha
+            # nomes locais mais rápido que globais. Cada campo é lido uma vez só (como
+            # argumento de _step_n), os resultados ficam em variáveis locais e são gravados
+            # de volta no 'state' todos juntos no final.
+            st = state
+            # --- PARTES A e B: CÉREBRO + NATUREZA (calculados em _step) ---
+            (temp, hum, soil, aquecedor, ventilador, pump, pump_run_seconds,
+             pid_output, pid_integral, pid_last_error, pwm_counter) = _step_n(
+                n, st.temperatura, st.umidade, st.soil_moisture,
+                st.aquecedor, st.ventilador, st.pump, st.pump_run_seconds,
+                st.modo_auto, st.pid_output, pid_integral, pid_last_error, pwm_counter,
+                ruido)
 
-        # --- PARTE C: SEGURANÇA (ALARMES) ---
-        alarm_msg = ""
-        if state["temperatura"] < 18: alarm_msg = "🚨 Temp Baixa!"
-        elif state["temperatura"] > 35: alarm_msg = "🚨 Temp Alta!"
-        elif state["soil_moisture"] < 20: alarm_msg = "🚨 Solo Seco!"
-        
-        state["alarm"] = alarm_msg
+            # --- PARTE C: SEGURANÇA (ALARMES) ---
+            # Na maioria dos ciclos nada muda, então só trocamos a mensagem quando a chave muda
+            alarm_k = (temp < 18) | ((temp > 35) << 1) | ((soil < 20) << 2)
+            if alarm_k != _last_alarm_k:
+                st.alarm = _ALARM_TBL[alarm_k]
+                _last_alarm_k = alarm_k
+
+            # Grava tudo de volta no 'state' de uma só vez
+            st.temperatura, st.umidade, st.soil_moisture = temp, hum, soil
+            st.aquecedor, st.ventilador, st.pump = aquecedor, ventilador, pump
+            st.pump_run_seconds, st.pid_output = pump_run_seconds, pid_output
 
-        # Registra no CSV e espera 1 segundo para o próximo ciclo
+        # Registra no CSV (só o estado final, mesmo que tenhamos recuperado vários ciclos)
+        # e espera até o horário do próximo ciclo
         append_history()
-        time.sleep(DT)
+        next_t += n * DT
+        espera = next_t - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
 
 # --- 11. ROTAS DO SITE (COMUNICAÇÃO COM O FRONTEND) ---
 
+def resposta_json(dados):
+    """Monta a resposta JSON para o navegador, usando o orjson se ele estiver instalado."""
+    if orjson is None:
+        return jsonify(dados)
+    return app.response_class(orjson.dumps(dados), mimetype="application/json")
+
+# Em produção a página não muda, então montamos ela uma vez só e guardamos
+# junto com uma "impressão digital" (ETag) do conteúdo.
+HOME_MAX_AGE = 300        # Por quantos segundos o navegador pode reaproveitar a página sem perguntar
+_home_cache = None        # (html, etag) depois da primeira visita
+
 @app.route("/")
 def home():
     """Carrega a página HTML principal."""
-    return render_template("index.html")
+    global _home_cache
+    # Em desenvolvimento, lemos o arquivo toda vez para ver as mudanças na hora
+    if app.debug:
+        return render_template("index.html")
+
+    if _home_cache is None:
+        html = render_template("index.html")
+        _home_cache = (html, hashlib.sha1(html.encode("utf-8")).hexdigest())
+    html, etag = _home_cache
+
+    resp = make_response(html)
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = HOME_MAX_AGE
+    # Se o navegador já tem esta versão (mesmo ETag), responde "304: nada mudou" sem reenviar o HTML
+    return resp.make_conditional(request)
 
 @app.route("/dados")
 def dados():
     """O JavaScript chama isso a cada 1s para pegar os números atualizados."""
-    return jsonify(state)
+    # Tiramos uma "foto" do estado com o cadeado fechado e enviamos a foto
+    with _state_lock:
+        snap = state.to_dict()
+    return resposta_json(snap)
+
+# Cada comando que o site pode enviar tem uma pequena função que sabe aplicá-lo.
+# Se o usuário clicar em um botão manual (Aquecedor/Ventilador/Bomba),
+# desligamos o modo automático para obedecer o usuário.
+def _set_aquecedor(valor):
+    state.aquecedor = bool(valor)
+    state.modo_auto = False
+
+def _set_ventilador(valor):
+    state.ventilador = bool(valor)
+    state.modo_auto = False
+
+def _set_pump(valor):
+    state.pump = bool(valor)
+    if not state.pump: state.pump_run_seconds = 0
+    state.modo_auto = False
+
+def _set_modo_auto(valor):
+    # Se o usuário clicar na caixa "Modo Automático"
+    global pid_integral, pid_last_error
+    state.modo_auto = bool(valor)
+    # Se ligou o automático, zeramos o PID para ele recomeçar limpo
+    if state.modo_auto:
+        pid_integral = 0.0
+        pid_last_error = 0.0
+
+def _reset_alarm(valor):
+    # Botão para limpar a mensagem de erro
+    global _last_alarm_k
+    state.alarm = ""
+    # Esquece o último alarme: se o problema continuar, ele volta no próximo ciclo (como antes)
+    _last_alarm_k = None
+
+# Tabela "nome do comando -> função". A ordem importa: os botões manuais vêm
+# antes do "modo_auto", para que um pedido como {pump: true, modo_auto: true}
+# termine com o modo automático ligado.
+_SETTERS = {
+    "aquecedor": _set_aquecedor,
+    "ventilador": _set_ventilador,
+    "pump": _set_pump,
+    "modo_auto": _set_modo_auto,
+    "reset_alarm": _reset_alarm,
+}
 
 @app.route("/comando", methods=["POST"])
 def comando():
     """Recebe ordens do usuário (cliques nos botões)."""
     # Tenta ler o JSON enviado pelo navegador
     cmd = request.get_json(force=True, silent=True)
-    if cmd:
-        # Se o usuário clicar em um botão manual (Aquecedor/Ventilador/Bomba),
-        # desligamos o modo automático para obedecer o usuário.
-        if "aquecedor" in cmd:
-            state["aquecedor"] = bool(cmd["aquecedor"])
-            state["modo_auto"] = False
-        if "ventilador" in cmd:
-            state["ventilador"] = bool(cmd["ventilador"])
-            state["modo_auto"] = False
-        if "pump" in cmd:
-            state["pump"] = bool(cmd["pump"])
-            if not state["pump"]: state["pump_run_seconds"] = 0
-            state["modo_auto"] = False
-            
-        # Se o usuário clicar na caixa "Modo Automático"
-        if "modo_auto" in cmd:
-            state["modo_auto"] = bool(cmd["modo_auto"])
-            # Se ligou o automático, zeramos o PID para ele recomeçar limpo
-            if state["modo_auto"]:
-                global pid_integral, pid_last_error
-                pid_integral = 0
-                pid_last_error = 0
-
-        # Botão para limpar a mensagem de erro
-        if "reset_alarm" in cmd:
-            state["alarm"] = ""
+    with _state_lock:
+        if isinstance(cmd, dict):
+            # Aplica cada comando que veio no pedido, seguindo a ordem da tabela
+            for chave, setter in _SETTERS.items():
+                if chave in cmd:
+                    setter(cmd[chave])
+        snap = state.to_dict()
             
-    return jsonify(state)
+    return resposta_json(snap)
 
 @app.route("/historico")
 def historico():
     """Permite baixar o arquivo CSV gerado."""
+    # Grava as linhas pendentes para o download incluir os dados mais recentes
+    flush_history_buffer()
+    # (O send_file já responde "304: nada mudou" se o navegador tem esta mesma versão do arquivo;
+    #  como novas linhas chegam a cada segundo, isso só acontece se nada foi gravado desde o último download.)
     return send_file(HISTORY_FILE, as_attachment=True, download_name="historico.csv")
 
+@app.route("/recentes")
+def recentes():
+    """Devolve as últimas leituras guardadas na memória (padrão: 5 minutos) para o gráfico da página."""
+    n = request.args.get("n", default=300, type=int)
+    return resposta_json(historico_recente(n))
+
 # --- 12. INICIALIZAÇÃO DO PROGRAMA ---
+_sim_thread = None        # A thread da simulação (None enquanto não foi iniciada)
+
+def iniciar_simulacao():
+    """
+    Cria e inicia a thread paralela que roda a função 'simular'.
+    Chamar de novo não faz nada: a simulação só pode rodar uma vez por processo.
+    """
+    global _sim_thread
+    if _sim_thread is None:
+        # 'daemon=True' significa que se fecharmos o site, a simulação morre junto.
+        _sim_thread = threading.Thread(target=simular, daemon=True)
+        _sim_thread.start()
+
+# Modo desenvolvimento:  python app.py
+# Modo produção:         gunicorn -w 1 --threads 4 wsgi:app
+# (Em produção use só 1 processo "-w 1": cada processo teria a sua própria estufa
+#  simulada. As --threads atendem vários navegadores ao mesmo tempo.)
 if __name__ == "__main__":
-    # Cria e inicia a thread paralela que roda a função 'simular'
-    # 'daemon=True' significa que se fecharmos o site, a simulação morre junto.
-    thr = threading.Thread(target=simular, daemon=True)
-    thr.start()
+    DEBUG = True
+    # Com debug=True o Flask roda este arquivo DUAS vezes: um processo "vigia" (que
+    # reinicia o site quando o código muda) e o processo que realmente atende o site.
+    # Só o segundo recebe WERKZEUG_RUN_MAIN="true"; é nele que a simulação deve rodar,
+    # senão teríamos duas estufas gravando no mesmo CSV.
+    if not DEBUG or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        iniciar_simulacao()
     
-    # Inicia o servidor web Flask
-    app.run(debug=True)
\ No newline at end of file
+    # Inicia o servidor web de desenvolvimento do Flask
+    app.run(debug=DEBUG)
@@ -0,0 +1,6 @@
+# wsgi.py
+# Ponto de entrada para servidores de produção (ex: gunicorn -w 1 --threads 4 wsgi:app).
+# Importa o site e liga a simulação, já que aqui o bloco "__main__" do app.py não roda.
+from app import app, iniciar_simulacao
+
+iniciar_simulacao()